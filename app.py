@@ -3,147 +3,376 @@
 # مسح شامل للسوق + بحث فوري + تفاصيل كاملة
 
 from flask import Flask, render_template, jsonify, request
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
 import yfinance as yf
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import json
+from contextlib import closing
+import functools
+import hashlib
+import heapq
+import orjson
 import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+
+# خيارات orjson: دعم أنواع numpy ومفاتيح غير نصية
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+class OrjsonProvider(JSONProvider):
+    """مزود JSON لـ Flask مبني على orjson (أسرع من json ويكتب bytes مباشرة)"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=ORJSON_OPTIONS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=ORJSON_OPTIONS),
+                                        mimetype='application/json')
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+Compress(app)  # ضغط الاستجابات (gzip/br) حسب ما يدعمه المتصفح
 
 # قائمة شاملة بجميع شركات السوق السعودي (143 شركة)
 from saudi_market_stocks import SAUDI_MARKET_STOCKS
+from indicators import VOLUME_DTYPE, compute_indicators_batch, stack_right_aligned
+
+# فهارس البحث (تُبنى مرة واحدة عند التشغيل): الرمز -> الشركة، والأسماء بأحرف صغيرة مسبقاً
+SYMBOL_INDEX = {}
+NAME_INDEX = []
+for _name, _data in SAUDI_MARKET_STOCKS.items():
+    _entry = (_name, _data['symbol'], _data['sector'])
+    SYMBOL_INDEX.setdefault(_data['symbol'], _entry)  # أول شركة بالرمز كما في البحث الخطي
+    NAME_INDEX.append((_name.lower(), _entry))
 
 # مسار ملف الكاش
 CACHE_FILE = 'market_scan_cache.json'
 CACHE_DURATION = timedelta(hours=6)  # تحديث كل 6 ساعات
 
-def get_yfinance_data(symbol, period="1y"):
-    """جلب بيانات السهم من Yahoo Finance"""
+# بعد 80% من مدة الصلاحية يبدأ تحديث الكاش في الخلفية مع الاستمرار في تقديم النسخة الحالية
+EARLY_REFRESH_RATIO = 0.8
+
+# قفل يمنع تشغيل أكثر من مسح للسوق في نفس الوقت
+_scan_lock = threading.Lock()
+
+# آخر نسخة مقروءة من ملف الكاش: (وقت تعديل الملف، محتواه) - لا يُعاد تحليله إلا إذا تغير
+_loaded_cache = (None, None)
+
+# كاش بيانات الأسعار لكل سهم على حدة (SQLite) بنفس مدة الصلاحية
+PRICE_CACHE_DB = 'price_cache.db'
+
+# أنواع أعمدة الأسعار المحفوظة: float32 يكفي لسعر بخانتين عشريتين و int32 للحجم
+OHLCV_DTYPES = {'Open': 'float32', 'High': 'float32', 'Low': 'float32',
+                'Close': 'float32', 'Volume': 'int32'}
+
+# كاش داخل الذاكرة أمام SQLite: (الرمز، الفترة) -> (وقت الجلب، البيانات)
+_price_memo = {}
+
+# رمز مؤشر تاسي في Yahoo Finance
+TASI_SYMBOL = "^TASI.SR"
+
+def _price_db():
+    """فتح قاعدة كاش الأسعار (وإنشاء الجدول إن لم يكن موجوداً)"""
+    conn = sqlite3.connect(PRICE_CACHE_DB, timeout=30)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS cache ('
+        'symbol TEXT, period TEXT, fetched_at REAL, ohlcv BLOB, '
+        'PRIMARY KEY (symbol, period))'
+    )
+    return conn
+
+def load_price_cache(symbol, period):
+    """تحميل بيانات سهم من كاش SQLite: (وقت الجلب، البيانات) أو None"""
+    try:
+        with closing(_price_db()) as conn:
+            row = conn.execute(
+                'SELECT fetched_at, ohlcv FROM cache WHERE symbol = ? AND period = ?',
+                (symbol, period)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], pickle.loads(row[1])
+    except Exception as e:
+        print(f"[ERROR] Failed to load price cache for {symbol}: {e}")
+        return None
+
+def save_price_cache(symbol, period, fetched_at, df):
+    """حفظ بيانات سهم في كاش SQLite"""
+    try:
+        with closing(_price_db()) as conn, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (symbol, period, fetched_at, ohlcv) VALUES (?, ?, ?, ?)',
+                (symbol, period, fetched_at, pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL))
+            )
+    except Exception as e:
+        print(f"[ERROR] Failed to save price cache for {symbol}: {e}")
+
+def quantize_prices(df):
+    """
+    تقليص بيانات الأسعار إلى أعمدة OHLCV بأنواع OHLCV_DTYPES (نصف الحجم في الذاكرة والكاش)
+    الحجم الأكبر من حد int32 يُقصّ إلى الحد بدلاً من أن يلتف إلى قيمة سالبة
+    """
+    df = df[list(OHLCV_DTYPES)]
+    volume = df['Volume'].fillna(0)
+    volume_max = np.iinfo(OHLCV_DTYPES['Volume']).max
+    if (volume > volume_max).any():
+        print(f"[WARNING] Volume above {volume_max} clipped to fit {OHLCV_DTYPES['Volume']}")
+        volume = volume.clip(upper=volume_max)
+    return df.assign(Volume=volume).astype(OHLCV_DTYPES)
+
+def get_cached_prices(symbol, period="1y", allow_stale=False):
+    """
+    بيانات السهم من الكاش (الذاكرة ثم SQLite) إن كانت صالحة، وإلا None
+    allow_stale=True يعيد آخر بيانات محفوظة حتى لو انتهت صلاحيتها
+    """
+    key = (symbol, period)
+    cached = _price_memo.get(key)
+    if cached is None:
+        cached = load_price_cache(symbol, period)
+    if cached is not None and (allow_stale or time.time() - cached[0] < CACHE_DURATION.total_seconds()):
+        _price_memo[key] = cached
+        return cached[1]
+    return None
+
+def store_prices(symbol, period, fetched_at, df):
+    """حفظ بيانات السهم في الكاش بطبقتيه"""
+    _price_memo[(symbol, period)] = (fetched_at, df)
+    # بيانات جديدة: قد تتغير الجلسة الأخيرة دون تغير تاريخها (أثناء التداول)
+    cached_indicators.cache_clear()
+    save_price_cache(symbol, period, fetched_at, df)
+
+def get_yfinance_data(symbol, period="1y", refresh=False):
+    """
+    جلب بيانات السهم من Yahoo Finance
+    يمر أولاً على كاش الذاكرة ثم SQLite، ولا يجلب من الشبكة إلا إذا انتهت الصلاحية
+    (refresh=True يتجاهل الكاش)
+    """
+    if not refresh:
+        df = get_cached_prices(symbol, period)
+        if df is not None:
+            return df
+    
+    fetched_at = time.time()
     try:
         ticker = yf.Ticker(symbol)
         df = ticker.history(period=period)
         if df.empty:
             return pd.DataFrame()
-        return df
+        df = quantize_prices(df)
     except Exception as e:
         print(f"[ERROR] Failed to fetch {symbol}: {e}")
         return pd.DataFrame()
+    
+    store_prices(symbol, period, fetched_at, df)
+    return df
+
+def fetch_all_histories(symbols, period="1y", refresh=False):
+    """
+    جلب بيانات عدة رموز دفعة واحدة عبر yf.download (طلبات متوازية بجلسة مشتركة)
+    يعيد {الرمز: DataFrame} ولا يطلب من الشبكة إلا الرموز غير الموجودة في الكاش
+    الرمز الذي لم يُرجعه التحميل يأخذ آخر بيانات محفوظة له (إن وجدت)
+    يعيد None إن فشل التحميل بالكامل
+    """
+    histories = {}
+    missing = []
+    for symbol in dict.fromkeys(symbols):
+        df = None if refresh else get_cached_prices(symbol, period)
+        if df is None:
+            missing.append(symbol)
+        else:
+            histories[symbol] = df
+    
+    if not missing:
+        return histories
+    
+    print(f"[INFO] Downloading {len(missing)} symbols...")
+    fetched_at = time.time()
+    try:
+        batch = yf.download(missing, period=period, group_by='ticker', threads=True,
+                            auto_adjust=True, progress=False)
+    except Exception as e:
+        print(f"[ERROR] Batch download failed: {e}")
+        return None
+    if batch.empty:
+        print("[ERROR] Batch download returned no data")
+        return None
+    
+    for symbol in missing:
+        df = pd.DataFrame()
+        if isinstance(batch.columns, pd.MultiIndex):
+            if symbol in batch.columns.get_level_values(0):
+                df = batch[symbol].dropna(how='all')
+        elif len(missing) == 1:
+            df = batch.dropna(how='all')
+        
+        if df.empty:
+            print(f"[ERROR] Failed to fetch {symbol}")
+            stale = get_cached_prices(symbol, period, allow_stale=True)
+            if stale is not None:
+                print(f"[INFO] Using last cached data for {symbol}")
+                df = stale
+        else:
+            df = quantize_prices(df)
+            store_prices(symbol, period, fetched_at, df)
+        histories[symbol] = df
+    
+    return histories
 
 def get_tasi_data():
     """جلب بيانات مؤشر تاسي"""
-    return get_yfinance_data("^TASI.SR", period="1y")
+    return get_yfinance_data(TASI_SYMBOL, period="1y")
+
+def is_tasi_bullish(tasi_data):
+    """هل إغلاق تاسي الأخير فوق متوسط آخر 5 جلسات؟"""
+    tasi_close = tasi_data["Close"].to_numpy()
+    return bool(tasi_close[-1] > np.nanmean(tasi_close[-5:]))  # nanmean يتجاهل الجلسات المفقودة مثل pandas
+
+def tasi_snapshot(tasi_data):
+    """آخر قيمة لتاسي ونسبة تغيره عن الجلسة السابقة (أصفار إن لم تتوفر البيانات)"""
+    if tasi_data.empty:
+        return {'tasi_current': 0, 'tasi_change': 0}
+    tasi_close = tasi_data["Close"].to_numpy()
+    return {
+        'tasi_current': round(float(tasi_close[-1]), 2),
+        'tasi_change': round(float((tasi_close[-1] / tasi_close[-2]) - 1) * 100, 2)
+    }
+
+def calculate_indicators_batch(frames):
+    """
+    حساب المؤشرات الفنية لعدة أسهم دفعة واحدة على مصفوفات (سهم × جلسة)
+    يعيد لكل سهم (بنفس الترتيب) قيم آخر جلسة والاختزالات المطلوبة فقط،
+    أو None إن كانت بياناته أقل من 200 جلسة
+    """
+    results = [None] * len(frames)
+    valid = [i for i, df in enumerate(frames) if not df.empty and len(df) >= 200]
+    if not valid:
+        return results
+    
+    close, starts = stack_right_aligned([frames[i]['Close'].to_numpy() for i in valid])
+    high, _ = stack_right_aligned([frames[i]['High'].to_numpy() for i in valid])
+    volume, _ = stack_right_aligned([frames[i]['Volume'].to_numpy() for i in valid],
+                                    dtype=VOLUME_DTYPE, fill=0)
+    (ma20, ma50, ma100, ma200, rsi, macd, signal_line,
+     upper_band, lower_band, obv, volume_ma20) = compute_indicators_batch(close, volume, starts)
+    
+    # اختزالات آخر الجلسات لجميع الأسهم مرة واحدة (كل صف فيه 200 جلسة على الأقل)
+    obv_mean20 = obv[:, -20:].mean(axis=1)
+    high_max10 = np.nanmax(high[:, -11:-1], axis=1)  # أعلى سعر في الجلسات العشر السابقة (تتجاهل المفقود)
+    
+    for row, i in enumerate(valid):
+        results[i] = {
+            'Close': float(close[row, -1]),
+            'Volume': int(volume[row, -1]),
+            'MA20': ma20[row, -1],
+            'MA50': ma50[row, -1],
+            'MA100': ma100[row, -1],
+            'MA200': ma200[row, -1],
+            'RSI': rsi[row, -1],
+            'MACD': macd[row, -1],
+            'Signal_Line': signal_line[row, -1],
+            'Upper_Band': upper_band[row, -1],
+            'BB_Middle': ma20[row, -1],
+            'Lower_Band': lower_band[row, -1],
+            'OBV': obv[row, -1],
+            'OBV_Mean20': obv_mean20[row],
+            'Volume_MA20': volume_ma20[row, -1],
+            'High_Max10': high_max10[row]
+        }
+    return results
 
 def calculate_indicators(df):
-    """حساب جميع المؤشرات الفنية"""
-    if df.empty or len(df) < 200:
-        return df
-    
-    # المتوسطات المتحركة
-    df['MA20'] = df['Close'].rolling(window=20).mean()
-    df['MA50'] = df['Close'].rolling(window=50).mean()
-    df['MA100'] = df['Close'].rolling(window=100).mean()
-    df['MA200'] = df['Close'].rolling(window=200).mean()
-    
-    # RSI
-    delta = df['Close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-    rs = gain / loss
-    df['RSI'] = 100 - (100 / (1 + rs))
-    
-    # MACD
-    exp1 = df['Close'].ewm(span=12, adjust=False).mean()
-    exp2 = df['Close'].ewm(span=26, adjust=False).mean()
-    df['MACD'] = exp1 - exp2
-    df['Signal_Line'] = df['MACD'].ewm(span=9, adjust=False).mean()
-    
-    # Bollinger Bands
-    df['BB_Middle'] = df['Close'].rolling(window=20).mean()
-    bb_std = df['Close'].rolling(window=20).std()
-    df['Upper_Band'] = df['BB_Middle'] + (bb_std * 2)
-    df['Lower_Band'] = df['BB_Middle'] - (bb_std * 2)
-    
-    # OBV
-    df['OBV'] = (np.sign(df['Close'].diff()) * df['Volume']).fillna(0).cumsum()
-    
-    # Volume Average
-    df['Volume_MA20'] = df['Volume'].rolling(window=20).mean()
-    
-    return df
+    """حساب جميع المؤشرات الفنية لسهم واحد"""
+    return calculate_indicators_batch([df])[0]
 
-def analyze_hawk_strategy(stock_data, tasi_data, sector_trend=True):
+@functools.lru_cache(maxsize=512)
+def cached_indicators(symbol, period, last_bar_ns):
+    """
+    مؤشرات السهم محفوظة حسب (الرمز، الفترة، تاريخ آخر جلسة)
+    تُحسب من البيانات الموجودة في كاش الذاكرة، وتُمسح عند وصول بيانات جديدة
+    """
+    return calculate_indicators(_price_memo[(symbol, period)][1])
+
+# أسماء الشروط بترتيب عرضها في الواجهة
+HAWK_CONDITIONS = ('tasi', 'sector', 'obv', 'volume', 'breakout', 'ma', 'rsi', 'macd', 'bollinger')
+QUICK_CONDITIONS = ('tasi', 'volume', 'breakout', 'ma20', 'ma50', 'rsi', 'macd', 'bollinger')
+
+def analyze_hawk_strategy(latest, tasi_bull, sector_trend=True):
     """
     استراتيجية صقر التداول (9 شروط)
     """
-    if stock_data.empty or len(stock_data) < 200:
+    if not latest:
         return None
     
-    latest = stock_data.iloc[-1]
-    
-    # الشروط التسعة
-    conditions = {
-        'tasi': bool(tasi_data["Close"].iloc[-1] > tasi_data["Close"].iloc[-5:].mean()),
-        'sector': sector_trend,  # افتراضي إيجابي
-        'obv': bool(latest["OBV"] > stock_data["OBV"].iloc[-20:].mean()),
-        'volume': bool(latest["Volume"] > latest["Volume_MA20"] * 2),
-        'breakout': bool(latest["Close"] > stock_data["High"].iloc[-11:-1].max()),
-        'ma': bool(latest["Close"] > latest["MA50"]),
-        'rsi': bool(50 < latest["RSI"] < 70),
-        'macd': bool(latest["MACD"] > latest["Signal_Line"] and latest["MACD"] > 0),
-        'bollinger': bool(latest["Close"] > latest["Upper_Band"])
-    }
-    
-    conditions_met = sum(conditions.values())
-    percentage = (conditions_met / 9) * 100
+    # الشروط التسعة كمصفوفة منطقية واحدة (بنفس ترتيب HAWK_CONDITIONS)
+    met = np.array([
+        tasi_bull,
+        sector_trend,  # افتراضي إيجابي
+        latest["OBV"] > latest["OBV_Mean20"],
+        latest["Volume"] > latest["Volume_MA20"] * 2,
+        latest["Close"] > latest["High_Max10"],
+        latest["Close"] > latest["MA50"],
+        (latest["RSI"] > 50) & (latest["RSI"] < 70),
+        (latest["MACD"] > latest["Signal_Line"]) & (latest["MACD"] > 0),
+        latest["Close"] > latest["Upper_Band"]
+    ], dtype=bool)
+    
+    conditions_met = int(met.sum())
+    total = len(HAWK_CONDITIONS)
+    percentage = (conditions_met / total) * 100
     
     return {
-        'conditions': conditions,
+        'conditions': dict(zip(HAWK_CONDITIONS, met.tolist())),
         'conditions_met': conditions_met,
-        'total_conditions': 9,
+        'total_conditions': total,
         'percentage': round(percentage, 1),
-        'signal': 'buy' if conditions_met == 9 else ('promising' if conditions_met >= 7 else 'watch')
+        'signal': 'buy' if conditions_met == total else ('promising' if conditions_met >= 7 else 'watch')
     }
 
-def analyze_quick_strategy(stock_data, tasi_data):
+def analyze_quick_strategy(latest, tasi_bull):
     """
     استراتيجية الفرصة السريعة (8 شروط - أكثر مرونة)
     """
-    if stock_data.empty or len(stock_data) < 200:
+    if not latest:
         return None
     
-    latest = stock_data.iloc[-1]
-    
-    # الشروط الثمانية (بدون OBV)
-    conditions = {
-        'tasi': bool(tasi_data["Close"].iloc[-1] > tasi_data["Close"].iloc[-5:].mean()),
-        'volume': bool(latest["Volume"] > latest["Volume_MA20"] * 1.5),  # أقل صرامة
-        'breakout': bool(latest["Close"] > stock_data["High"].iloc[-11:-1].max()),
-        'ma20': bool(latest["Close"] > latest["MA20"]),  # MA20 بدلاً من MA50
-        'ma50': bool(latest["Close"] > latest["MA50"]),
-        'rsi': bool(45 < latest["RSI"] < 75),  # نطاق أوسع
-        'macd': bool(latest["MACD"] > latest["Signal_Line"]),  # بدون شرط الصفر
-        'bollinger': bool(latest["Close"] > latest["BB_Middle"])  # الوسط بدلاً من الأعلى
-    }
-    
-    conditions_met = sum(conditions.values())
-    percentage = (conditions_met / 8) * 100
+    # الشروط الثمانية (بدون OBV) بنفس ترتيب QUICK_CONDITIONS
+    met = np.array([
+        tasi_bull,
+        latest["Volume"] > latest["Volume_MA20"] * 1.5,  # أقل صرامة
+        latest["Close"] > latest["High_Max10"],
+        latest["Close"] > latest["MA20"],  # MA20 بدلاً من MA50
+        latest["Close"] > latest["MA50"],
+        (latest["RSI"] > 45) & (latest["RSI"] < 75),  # نطاق أوسع
+        latest["MACD"] > latest["Signal_Line"],  # بدون شرط الصفر
+        latest["Close"] > latest["BB_Middle"]  # الوسط بدلاً من الأعلى
+    ], dtype=bool)
+    
+    conditions_met = int(met.sum())
+    total = len(QUICK_CONDITIONS)
+    percentage = (conditions_met / total) * 100
     
     return {
-        'conditions': conditions,
+        'conditions': dict(zip(QUICK_CONDITIONS, met.tolist())),
         'conditions_met': conditions_met,
-        'total_conditions': 8,
+        'total_conditions': total,
         'percentage': round(percentage, 1),
-        'signal': 'buy' if conditions_met == 8 else ('promising' if conditions_met >= 6 else 'watch')
+        'signal': 'buy' if conditions_met == total else ('promising' if conditions_met >= 6 else 'watch')
     }
 
-def calculate_entry_exit_points(stock_data):
+def calculate_entry_exit_points(latest):
     """حساب نقاط الدخول والخروج"""
-    if stock_data.empty:
+    if not latest:
         return None
     
-    latest = stock_data.iloc[-1]
     current_price = latest["Close"]
     
     # سعر الدخول المقترح (السعر الحالي أو أقل قليلاً)
@@ -168,13 +397,11 @@ def calculate_entry_exit_points(stock_data):
         'risk_reward_2': round((target2 - entry_price) / (entry_price - stop_loss), 2)
     }
 
-def get_all_indicators(stock_data):
+def get_all_indicators(latest):
     """جلب جميع المؤشرات للعرض"""
-    if stock_data.empty:
+    if not latest:
         return None
     
-    latest = stock_data.iloc[-1]
-    
     return {
         'rsi': round(latest["RSI"], 2),
         'macd': round(latest["MACD"], 2),
@@ -191,6 +418,32 @@ def get_all_indicators(stock_data):
         'volume_ma20': int(latest["Volume_MA20"])
     }
 
+def build_analysis(company_name, symbol, sector, latest, tasi_bull, timestamp=None):
+    """بناء نتيجة تحليل السهم من مؤشراته المحسوبة (المسح يمرر وقتاً موحداً لكل الأسهم)"""
+    # تحليل الاستراتيجيتين
+    hawk_analysis = analyze_hawk_strategy(latest, tasi_bull)
+    quick_analysis = analyze_quick_strategy(latest, tasi_bull)
+    
+    if not hawk_analysis or not quick_analysis:
+        return None
+    
+    # حساب نقاط الدخول والخروج
+    entry_exit = calculate_entry_exit_points(latest)
+    
+    # جلب جميع المؤشرات
+    indicators = get_all_indicators(latest)
+    
+    return {
+        'company': company_name,
+        'symbol': symbol,
+        'sector': sector,
+        'hawk': hawk_analysis,
+        'quick': quick_analysis,
+        'entry_exit': entry_exit,
+        'indicators': indicators,
+        'timestamp': timestamp or datetime.now().isoformat()
+    }
+
 def analyze_single_stock(company_name, symbol, sector):
     """تحليل سهم واحد بالكامل"""
     print(f"[INFO] Analyzing {company_name} ({symbol})...")
@@ -202,68 +455,76 @@ def analyze_single_stock(company_name, symbol, sector):
     if stock_data.empty:
         return None
     
-    # حساب المؤشرات
-    stock_data = calculate_indicators(stock_data)
+    # حساب المؤشرات (أو إعادتها من الكاش إن لم تتغير البيانات)
+    latest = cached_indicators(yf_symbol, "1y", stock_data.index[-1].value)
     
     # جلب بيانات تاسي
     tasi_data = get_tasi_data()
     if tasi_data.empty:
         return None
     
-    # تحليل الاستراتيجيتين
-    hawk_analysis = analyze_hawk_strategy(stock_data, tasi_data)
-    quick_analysis = analyze_quick_strategy(stock_data, tasi_data)
+    return build_analysis(company_name, symbol, sector, latest, is_tasi_bullish(tasi_data))
+
+def scan_market(refresh=False):
+    """
+    مسح السوق بالكامل (143 شركة) - refresh=True يعيد جلب كل الأسعار من Yahoo
+    يعيد (نتائج الأسهم، لقطة تاسي) لحفظهما معاً في الكاش،
+    أو None إن فشل جلب البيانات (حتى لا يُستبدل كاش سليم بنتائج فارغة)
+    """
+    print("[INFO] Starting full market scan...")
     
-    if not hawk_analysis or not quick_analysis:
+    # جلب بيانات جميع الأسهم وتاسي دفعة واحدة، ثم التحليل محلياً بدون شبكة
+    symbols = [f"{data['symbol']}.SR" for data in SAUDI_MARKET_STOCKS.values()]
+    histories = fetch_all_histories([TASI_SYMBOL] + symbols, refresh=refresh)
+    if histories is None:
+        print("[ERROR] Market data unavailable, market scan aborted")
         return None
     
-    # حساب نقاط الدخول والخروج
-    entry_exit = calculate_entry_exit_points(stock_data)
+    tasi_data = histories[TASI_SYMBOL]
+    if tasi_data.empty:
+        print("[ERROR] TASI data unavailable, market scan aborted")
+        return None
+    tasi_bull = is_tasi_bullish(tasi_data)
     
-    # جلب جميع المؤشرات
-    indicators = get_all_indicators(stock_data)
+    # حساب مؤشرات جميع الأسهم دفعة واحدة
+    companies = list(SAUDI_MARKET_STOCKS.items())
+    all_latest = calculate_indicators_batch(
+        [histories[f"{data['symbol']}.SR"] for _, data in companies]
+    )
     
-    return {
-        'company': company_name,
-        'symbol': symbol,
-        'sector': sector,
-        'hawk': hawk_analysis,
-        'quick': quick_analysis,
-        'entry_exit': entry_exit,
-        'indicators': indicators,
-        'timestamp': datetime.now().isoformat()
-    }
-
-def scan_market():
-    """مسح السوق بالكامل (143 شركة)"""
-    print("[INFO] Starting full market scan...")
+    timestamp = datetime.now().isoformat()
     results = []
-    
-    for company_name, data in SAUDI_MARKET_STOCKS.items():
-        symbol = data['symbol']
-        sector = data['sector']
-        
-        analysis = analyze_single_stock(company_name, symbol, sector)
+    for (company_name, data), latest in zip(companies, all_latest):
+        analysis = build_analysis(company_name, data['symbol'], data['sector'],
+                                  latest, tasi_bull, timestamp)
         if analysis:
             results.append(analysis)
     
     print(f"[INFO] Market scan completed. {len(results)} stocks analyzed.")
-    return results
+    return results, tasi_snapshot(tasi_data)
 
-def load_cache():
-    """تحميل البيانات المحفوظة"""
+def load_cache(allow_expired=False):
+    """
+    تحميل الكاش المحفوظ ({'timestamp', 'data', 'tasi'}) إن كان صالحاً
+    allow_expired=True يعيده حتى بعد انتهاء صلاحيته (عند فشل مسح جديد)
+    """
+    global _loaded_cache
     if not os.path.exists(CACHE_FILE):
         return None
     
     try:
-        with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-            cache = json.load(f)
+        mtime = os.stat(CACHE_FILE).st_mtime_ns
+        if _loaded_cache[0] == mtime:
+            cache = _loaded_cache[1]
+        else:
+            with open(CACHE_FILE, 'rb') as f:
+                cache = orjson.loads(f.read())
+            _loaded_cache = (mtime, cache)
         
         # التحقق من صلاحية الكاش
-        cache_time = datetime.fromisoformat(cache['timestamp'])
-        if datetime.now() - cache_time < CACHE_DURATION:
+        if allow_expired or cache_age(cache) < CACHE_DURATION:
             print("[INFO] Using cached data")
-            return cache['data']
+            return cache
         else:
             print("[INFO] Cache expired")
             return None
@@ -271,18 +532,100 @@ def load_cache():
         print(f"[ERROR] Failed to load cache: {e}")
         return None
 
-def save_cache(data):
-    """حفظ البيانات"""
+def save_cache(data, tasi):
+    """حفظ نتائج المسح مع لقطة تاسي"""
+    cache = {
+        'timestamp': datetime.now().isoformat(),
+        'data': data,
+        'tasi': tasi
+    }
     try:
-        cache = {
-            'timestamp': datetime.now().isoformat(),
-            'data': data
-        }
-        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(cache, f, ensure_ascii=False, indent=2)
+        with open(CACHE_FILE, 'wb') as f:
+            f.write(orjson.dumps(cache, option=ORJSON_OPTIONS))
         print("[INFO] Cache saved")
     except Exception as e:
         print(f"[ERROR] Failed to save cache: {e}")
+    return cache
+
+@functools.lru_cache(maxsize=8)
+def parse_timestamp(timestamp):
+    """تحليل وقت الكاش مرة واحدة لكل قيمة"""
+    return datetime.fromisoformat(timestamp)
+
+def cache_age(cache):
+    """عمر الكاش منذ آخر مسح"""
+    return datetime.now() - parse_timestamp(cache['timestamp'])
+
+def should_refresh_early(cache):
+    """
+    انتهاء صلاحية احتمالي (XFetch): بعد EARLY_REFRESH_RATIO من مدة الصلاحية
+    يزداد احتمال التحديث خطياً حتى يصل إلى 1 عند انتهائها
+    """
+    age_ratio = cache_age(cache) / CACHE_DURATION
+    if age_ratio < EARLY_REFRESH_RATIO:
+        return False
+    return random.random() < (age_ratio - EARLY_REFRESH_RATIO) / (1 - EARLY_REFRESH_RATIO)
+
+def refresh_cache_in_background():
+    """تحديث الكاش في خيط منفصل (يتجاهل الطلب إن كان هناك مسح قيد التنفيذ)"""
+    if not _scan_lock.acquire(blocking=False):
+        return
+    
+    def run():
+        try:
+            scan = scan_market(refresh=True)
+            if scan is None:
+                print("[ERROR] Background refresh failed, keeping current cache")
+            else:
+                save_cache(*scan)
+        except Exception as e:
+            print(f"[ERROR] Background refresh failed: {e}")
+        finally:
+            _scan_lock.release()
+    
+    print("[INFO] Refreshing cache in background")
+    threading.Thread(target=run, daemon=True).start()
+
+def _push_top(heap, item, top_n):
+    """إضافة عنصر إلى كومة أفضل top_n (أصغرها في القمة ليُستبعد أولاً)"""
+    if len(heap) < top_n:
+        heapq.heappush(heap, item)
+    else:
+        heapq.heappushpop(heap, item)
+
+def rank_results(data, top_n=20):
+    """
+    ترتيب النتائج وعدّ إشارات الشراء للاستراتيجيتين في مرور واحد على البيانات
+    يعيد (أفضل الصقر، أفضل الفرصة السريعة، عدد إشارات الصقر، عدد إشارات الفرصة)
+    عند التساوي في النسبة يتقدم السهم الأسبق في القائمة (مثل sorted)
+    """
+    hawk_heap, quick_heap = [], []
+    hawk_signals = quick_signals = 0
+    
+    for i, d in enumerate(data):
+        hawk, quick = d['hawk'], d['quick']
+        if hawk:
+            hawk_signals += hawk['signal'] == 'buy'
+            _push_top(hawk_heap, (hawk['percentage'], -i, d), top_n)
+        if quick:
+            quick_signals += quick['signal'] == 'buy'
+            _push_top(quick_heap, (quick['percentage'], -i, d), top_n)
+    
+    hawk_top = [d for _, _, d in sorted(hawk_heap, reverse=True)]
+    quick_top = [d for _, _, d in sorted(quick_heap, reverse=True)]
+    return hawk_top, quick_top, hawk_signals, quick_signals
+
+def find_stock(query):
+    """البحث عن سهم: مطابقة تامة للرمز أولاً، ثم جزء من الاسم -> (الاسم، الرمز، القطاع)"""
+    found = SYMBOL_INDEX.get(query)
+    if found:
+        return found
+    
+    query = query.lower()
+    for name_lower, entry in NAME_INDEX:
+        if query in name_lower:
+            return entry
+    return None
 
 @app.route('/')
 def index():
@@ -293,40 +636,56 @@ def index():
 def api_market_scan():
     """API: مسح السوق (يستخدم الكاش إن وجد)"""
     # محاولة تحميل من الكاش
-    data = load_cache()
-    
-    if data is None:
-        # مسح جديد
-        data = scan_market()
-        save_cache(data)
-    
-    # ترتيب النتائج
-    hawk_top = sorted([d for d in data if d['hawk']], 
-                     key=lambda x: x['hawk']['percentage'], reverse=True)[:20]
-    quick_top = sorted([d for d in data if d['quick']], 
-                      key=lambda x: x['quick']['percentage'], reverse=True)[:20]
-    
-    # إحصائيات
-    tasi_data = get_tasi_data()
-    tasi_current = round(tasi_data["Close"].iloc[-1], 2) if not tasi_data.empty else 0
-    tasi_change = round(((tasi_data["Close"].iloc[-1] / tasi_data["Close"].iloc[-2]) - 1) * 100, 2) if not tasi_data.empty else 0
-    
-    hawk_signals = len([d for d in data if d['hawk']['signal'] == 'buy'])
-    quick_signals = len([d for d in data if d['quick']['signal'] == 'buy'])
-    
-    return jsonify({
+    cache = load_cache()
+    
+    if cache is None:
+        # مسح جديد (طلب واحد فقط يمسح، والبقية تنتظر نتيجته)
+        with _scan_lock:
+            cache = load_cache()
+            if cache is None:
+                scan = scan_market()
+                if scan is not None:
+                    cache = save_cache(*scan)
+                else:
+                    # فشل المسح: آخر كاش محفوظ (حتى لو انتهت صلاحيته) أفضل من نتائج فارغة
+                    cache = load_cache(allow_expired=True) or {
+                        'timestamp': datetime.now().isoformat(), 'data': [], 'tasi': None
+                    }
+    elif should_refresh_early(cache):
+        refresh_cache_in_background()
+    
+    # ETag مشتق من وقت آخر مسح: إن لم يتغير الكاش لا داعي لإعادة إرسال البيانات
+    # (ضعيف لأن المحتوى نفسه قد يُرسل مضغوطاً أو لا، ووقت الاستجابة يتغير)
+    etag = hashlib.md5(cache['timestamp'].encode(), usedforsecurity=False).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    
+    data = cache['data']
+    
+    # ترتيب النتائج وعدّ الإشارات في مرور واحد
+    hawk_top, quick_top, hawk_signals, quick_signals = rank_results(data)
+    
+    # إحصائيات (لقطة تاسي محفوظة مع المسح، بدون طلب شبكة)
+    tasi = cache.get('tasi') or {'tasi_current': 0, 'tasi_change': 0}
+    
+    response = jsonify({
         'success': True,
         'timestamp': datetime.now().isoformat(),
         'stats': {
             'total_stocks': len(data),
-            'tasi_current': tasi_current,
-            'tasi_change': tasi_change,
+            'tasi_current': tasi['tasi_current'],
+            'tasi_change': tasi['tasi_change'],
             'hawk_signals': hawk_signals,
             'quick_signals': quick_signals
         },
         'hawk_top20': hawk_top,
         'quick_top20': quick_top
     })
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True  # المتصفح يتحقق دائماً عبر If-None-Match
+    return response
 
 @app.route('/api/search')
 def api_search():
@@ -336,13 +695,7 @@ def api_search():
     if not query:
         return jsonify({'success': False, 'error': 'No query provided'})
     
-    # البحث في القائمة
-    found = None
-    for company_name, data in SAUDI_MARKET_STOCKS.items():
-        if query.lower() in company_name.lower() or query == data['symbol']:
-            found = (company_name, data['symbol'], data['sector'])
-            break
-    
+    found = find_stock(query)
     if not found:
         return jsonify({'success': False, 'error': 'Stock not found'})
     
@@ -357,10 +710,14 @@ def api_search():
 @app.route('/api/refresh')
 def api_refresh():
     """API: مسح جديد للسوق (تجاهل الكاش)"""
-    data = scan_market()
-    save_cache(data)
-    
-    return jsonify({'success': True, 'message': 'Market scan completed', 'total': len(data)})
+    with _scan_lock:
+        scan = scan_market(refresh=True)
+        if scan is not None:
+            save_cache(*scan)
+    
+    if scan is None:
+        return jsonify({'success': False, 'error': 'Market scan failed'})
+    return jsonify({'success': True, 'message': 'Market scan completed', 'total': len(scan[0])})
 
 if __name__ == '__main__':
     # إنشاء مجلد templates إن لم يكن موجوداً
@@ -0,0 +1,205 @@
+# نواة حساب المؤشرات الفنية
+# نواة Numba لكل سهم (متوسطات متدحرجة عبر _rolling_mean، متوسطات أسية عبر _ewma، RSI و OBV في حلقة واحدة)
+# و Bollinger خارج النواة عبر sliding_window_view على مصفوفة المسح كاملة، بدلاً من سلسلة عمليات pandas rolling/ewm
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+try:
+    from numba import njit
+except ImportError:
+    # numba اختياري: بدونه تعمل النواة كدالة بايثون عادية (أبطأ لكن بنفس النتائج)
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+# أنواع المدخلات الثابتة للمسح (مطابقة لأعمدة الأسعار المحفوظة)
+PRICE_DTYPE = np.float32
+VOLUME_DTYPE = np.int32
+
+# عدد المؤشرات التي تحسبها النواة لكل سهم
+N_KERNEL_OUTPUTS = 9
+
+# نوافذ المؤشرات (ثوابت على مستوى الوحدة يعاملها Numba كقيم حرفية)
+RSI_WINDOW = 14
+BB_WINDOW = 20
+BB_STD = 2
+VOLUME_WINDOW = 20
+MACD_FAST = 12
+MACD_SLOW = 26
+MACD_SIGNAL = 9
+
+
+@njit(cache=True)
+def _ewma(x, span):
+    """
+    المتوسط الأسي (مطابق لـ pandas ewm(span, adjust=False)) بدقة float64
+    القيمة المفقودة (NaN) تُبقي آخر متوسط وتُخفّض وزنه كما في pandas (ignore_na=False)
+    """
+    alpha = 2.0 / (span + 1)
+    y = np.empty(x.shape[0])
+    if x.shape[0] == 0:
+        return y
+    weighted = np.float64(x[0])
+    old_wt = 1.0
+    y[0] = weighted
+    for i in range(1, x.shape[0]):
+        value = np.float64(x[i])
+        if weighted == weighted:
+            old_wt *= 1 - alpha
+            if value == value:
+                weighted = (old_wt * weighted + alpha * value) / (old_wt + alpha)
+                old_wt = 1.0
+        elif value == value:
+            weighted = value
+        y[i] = weighted
+    return y
+
+
+@njit(cache=True)
+def _rolling_mean(x, window):
+    """
+    المتوسط المتحرك البسيط (مطابق لـ pandas rolling(window).mean()) بمجموع متدحرج بدقة float64
+    النتيجة NaN طالما بقيت قيمة مفقودة داخل النافذة فقط، ولا تُفسد ما بعدها
+    """
+    n = x.shape[0]
+    y = np.full(n, np.nan)
+    total = 0.0
+    missing = 0
+    for i in range(n):
+        value = np.float64(x[i])
+        if value == value:
+            total += value
+        else:
+            missing += 1
+        if i >= window:
+            old = np.float64(x[i - window])
+            if old == old:
+                total -= old
+            else:
+                missing -= 1
+        if i >= window - 1 and missing == 0:
+            y[i] = total / window
+    return y
+
+
+@njit(cache=True, error_model='numpy')
+def _compute_indicators(close, volume):
+    """
+    حساب مؤشرات سهم واحد (المتوسطات عبر _rolling_mean، MACD عبر _ewma، و Bollinger خارج النواة)
+    النتائج مطابقة لحسابات pandas السابقة (rolling/ewm بـ adjust=False)
+    """
+    n = close.shape[0]
+    rsi = np.full(n, np.nan)
+    obv = np.empty(n)
+
+    # المتوسطات المتحركة
+    ma20 = _rolling_mean(close, 20)
+    ma50 = _rolling_mean(close, 50)
+    ma100 = _rolling_mean(close, 100)
+    ma200 = _rolling_mean(close, 200)
+    volume_ma20 = _rolling_mean(volume, VOLUME_WINDOW)
+
+    # MACD
+    macd = _ewma(close, MACD_FAST) - _ewma(close, MACD_SLOW)
+    signal = _ewma(macd, MACD_SIGNAL)
+
+    # np.float64 وليس 0.0: بدون numba تعطي القسمة على صفر inf/NaN بدلاً من ZeroDivisionError
+    gain_sum = np.float64(0.0)
+    loss_sum = np.float64(0.0)
+    obv_total = 0.0
+
+    for i in range(n):
+        price = np.float64(close[i])  # المجاميع بدقة float64 حتى مع مدخلات float32
+
+        # RSI (متوسط بسيط للمكاسب والخسائر)
+        if i > 0:
+            delta = price - close[i - 1]
+            if delta > 0:
+                gain_sum += delta
+            elif delta < 0:
+                loss_sum -= delta
+        if i >= RSI_WINDOW:
+            old_delta = 0.0
+            if i > RSI_WINDOW:
+                old_delta = np.float64(close[i - RSI_WINDOW]) - close[i - RSI_WINDOW - 1]
+            if old_delta > 0:
+                gain_sum -= old_delta
+            elif old_delta < 0:
+                loss_sum += old_delta
+        if i >= RSI_WINDOW - 1:
+            rs = gain_sum / loss_sum
+            rsi[i] = 100 - (100 / (1 + rs))
+
+        # OBV
+        if i > 0:
+            if price > close[i - 1]:
+                obv_total += volume[i]
+            elif price < close[i - 1]:
+                obv_total -= volume[i]
+        obv[i] = obv_total
+
+    return ma20, ma50, ma100, ma200, rsi, macd, signal, obv, volume_ma20
+
+
+@njit('void(float32[:, ::1], int32[:, ::1], int64[::1], float64[:, :, ::1])',
+      cache=True, boundscheck=False, error_model='numpy')
+def scan_all_indicators(close, volume, starts, out):
+    """
+    تطبيق النواة على كل صف (سهم) من مصفوفات المسح ثنائية الأبعاد
+    تُترجم مرة واحدة عند الاستيراد بتوقيع ثابت (float32 للأسعار و int32 للحجم)
+    وتكتب النتائج في out بشكل (N_KERNEL_OUTPUTS، سهم، جلسة)
+    """
+    out[:] = np.nan
+    for row in range(close.shape[0]):
+        start = starts[row]
+        results = _compute_indicators(close[row, start:], volume[row, start:])
+        for k in range(N_KERNEL_OUTPUTS):
+            out[k, row, start:] = results[k]
+
+
+def bollinger_bands(close):
+    """
+    حدود Bollinger لجميع الأسهم دفعة واحدة عبر نوافذ متحركة بدون نسخ (sliding_window_view)
+    الانحراف المعياري يُحسب بدقة من كل نافذة (ddof=1 مثل pandas rolling.std)
+    """
+    upper = np.full(close.shape, np.nan)
+    lower = np.full(close.shape, np.nan)
+    if close.shape[1] < BB_WINDOW:
+        return upper, lower
+    windows = sliding_window_view(close, BB_WINDOW, axis=1)
+    middle = windows.mean(axis=-1, dtype=np.float64)
+    bb_std = windows.std(axis=-1, ddof=1, dtype=np.float64)
+    upper[:, BB_WINDOW - 1:] = middle + bb_std * BB_STD
+    lower[:, BB_WINDOW - 1:] = middle - bb_std * BB_STD
+    return upper, lower
+
+
+def stack_right_aligned(arrays, dtype=PRICE_DTYPE, fill=np.nan):
+    """
+    تكديس سلاسل بأطوال مختلفة في مصفوفة (سهم × جلسة) متصلة محاذاة من اليمين
+    آخر جلسة لكل سهم في العمود الأخير، والبداية مملوءة بـ fill
+    يعيد المصفوفة ومؤشر بداية البيانات الفعلية لكل صف
+    """
+    n_bars = max((len(a) for a in arrays), default=0)
+    stacked = np.full((len(arrays), n_bars), fill, dtype=dtype)
+    starts = np.empty(len(arrays), dtype=np.int64)
+    for row, values in enumerate(arrays):
+        starts[row] = n_bars - len(values)
+        stacked[row, starts[row]:] = values
+    return stacked, starts
+
+
+def compute_indicators_batch(close, volume, starts):
+    """
+    حساب المؤشرات لجميع الأسهم دفعة واحدة
+    close/volume: مصفوفات (سهم × جلسة) من stack_right_aligned بنوعي PRICE_DTYPE و VOLUME_DTYPE
+    يعيد بنفس الشكل: MA20, MA50, MA100, MA200, RSI, MACD, Signal,
+    Upper_Band, Lower_Band, OBV, Volume_MA20
+    """
+    out = np.empty((N_KERNEL_OUTPUTS,) + close.shape)
+    scan_all_indicators(close, volume, starts, out)
+    ma20, ma50, ma100, ma200, rsi, macd, signal, obv, volume_ma20 = out
+    upper, lower = bollinger_bands(close)
+    return ma20, ma50, ma100, ma200, rsi, macd, signal, upper, lower, obv, volume_ma20